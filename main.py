@@ -2,182 +2,620 @@
 # This demonstrates using Redis as a cache layer for PostgreSQL queries
 
 import psycopg2
+import psycopg2.extensions
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor, execute_values
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 import redis
-import json
+from cachetools import TTLCache
+import msgspec
+import orjson
+import logging
+import os
+import random
+import threading
 import time
-from typing import Optional, List, Dict
+import uuid
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Optional, Iterator, List, Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Query results (lists of users) are stored as msgpack by default; encoder/decoder are reused across calls
+_ENC = msgspec.msgpack.Encoder()
+_DEC = msgspec.msgpack.Decoder()
+
+
+class MsgpackArrayWriter:
+    """Encodes a msgpack array one item at a time into a single growing buffer"""
+
+    def __init__(self):
+        # array32 header; the length is filled in by finish() once it is known
+        self.buf = bytearray(b"\xdd\x00\x00\x00\x00")
+        self.count = 0
+
+    def append(self, item):
+        _ENC.encode_into(item, self.buf, -1)
+        self.count += 1
+
+    def finish(self) -> memoryview:
+        self.buf[1:5] = self.count.to_bytes(4, 'big')
+        return memoryview(self.buf)
+
+
+class JsonArrayWriter:
+    """Encodes a JSON array one item at a time into a single growing buffer"""
+
+    def __init__(self):
+        self.buf = bytearray(b"[")
+
+    def append(self, item):
+        if len(self.buf) > 1:
+            self.buf += b","
+        self.buf += orjson.dumps(item)
+
+    def finish(self) -> memoryview:
+        self.buf += b"]"
+        return memoryview(self.buf)
+
+
+# Encoder, decoder and streaming array writer per cache format; 'json' is the
+# human-readable alternative for when cache values need to be inspected with redis-cli
+CACHE_FORMATS = {
+    'msgpack': (_ENC.encode, _DEC.decode, MsgpackArrayWriter),
+    'json': (orjson.dumps, orjson.loads, JsonArrayWriter),
+}
+
+# Base cache TTLs in seconds per key domain; each write gets ±10% jitter to avoid synchronized expiry
+DEFAULT_TTLS = {
+    'user': 300,
+    'age_range': 120,
+    'not_found': 30,
+}
+TTL_JITTER = 0.1
+
+# Hash field cached under a user key when the user doesn't exist, so repeated lookups skip PostgreSQL
+NOT_FOUND_FIELD = b"__none__"
+
+# Redis set recording every cached age range key, so invalidation doesn't have to SCAN
+AGE_RANGE_INDEX_KEY = "idx:users:age"
+
+# Single-flight lock used on cache miss so only one worker queries PostgreSQL per user
+LOCK_TIMEOUT_MS = 5000
+LOCK_POLL_INTERVAL = 0.02
+
+# PostgreSQL connections kept open by the pool, and how long a caller waits for a free one
+DEFAULT_POOL_SIZE = 10
+POOL_TIMEOUT = 30
+
+# Deletes the lock only if it still holds our token, so a worker whose lock expired
+# can't release one that another worker has since acquired
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# SQL statements, built once at import time
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS users (
+    id SERIAL PRIMARY KEY,
+    name VARCHAR(100) NOT NULL,
+    email VARCHAR(100) UNIQUE NOT NULL,
+    age INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+-- Lets age range queries use an index scan that returns rows already sorted by age
+CREATE INDEX IF NOT EXISTS idx_users_age ON users (age);
+"""
+SEED_CHECK_SQL = "SELECT 1 FROM users LIMIT 1;"
+SEED_USERS_SQL = "INSERT INTO users (name, email, age) VALUES %s"
+# Used by iter_users_by_age_range through a server-side cursor (which can't EXECUTE a prepared
+# statement), fetching AGE_RANGE_ITERSIZE rows per roundtrip instead of the whole result at once
+AGE_RANGE_SQL = "SELECT id, name, email, age FROM users WHERE age BETWEEN %s AND %s ORDER BY age"
+AGE_RANGE_ITERSIZE = 1000
+# created_at is formatted as ISO 8601 text by PostgreSQL (NULL stays NULL), so no datetime
+# objects are built just to be stringified for the cache
+CREATED_AT_SQL = "to_char(created_at, 'YYYY-MM-DD\"T\"HH24:MI:SS.US') AS created_at"
+CREATE_USER_SQL = f"INSERT INTO users (name, email, age) VALUES (%s, %s, %s) RETURNING id, {CREATED_AT_SQL}"
+
+# Hot-path queries prepared once per pooled connection, so cache misses skip parse/plan
+PREPARED_STATEMENTS = {
+    'get_user': f"SELECT id, name, email, age, {CREATED_AT_SQL} FROM users WHERE id = $1",
+    'get_users_by_age': "SELECT id, name, email, age FROM users WHERE age BETWEEN $1 AND $2 ORDER BY age",
+    'get_users_by_ids': f"SELECT id, name, email, age, {CREATED_AT_SQL} FROM users WHERE id = ANY($1)",
+}
+PREPARE_SQL = ";".join(f"PREPARE {name} AS {query}" for name, query in PREPARED_STATEMENTS.items())
+
+
+# Columns update_user is allowed to change
+UPDATABLE_COLUMNS = frozenset({'name', 'email', 'age'})
+
+
+# Rendered UPDATE statements per sorted column tuple (at most one per subset of UPDATABLE_COLUMNS)
+_UPDATE_SQL: Dict[Tuple[str, ...], str] = {}
+
+
+def build_update_sql(columns: Tuple[str, ...]) -> sql.Composed:
+    """Build the UPDATE statement for a set of columns"""
+    set_clause = sql.SQL(", ").join(sql.Identifier(column) + sql.SQL(" = %s") for column in columns)
+    return sql.SQL(
+        "UPDATE users SET {} WHERE id = %s RETURNING id, name, email, age, " + CREATED_AT_SQL
+    ).format(set_clause)
+
+
+def update_sql(columns: Tuple[str, ...], cur) -> str:
+    """Return the rendered UPDATE statement for a sorted column tuple, rendering it on first use
+
+    Identifier quoting is the same on every connection to the server, so the
+    string rendered with one cursor is shared by all of them.
+    """
+    query = _UPDATE_SQL.get(columns)
+    if query is None:
+        query = _UPDATE_SQL[columns] = build_update_sql(columns).as_string(cur)
+    return query
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers whether PREPARED_STATEMENTS have been prepared on it"""
+    prepared = False
+
+
+# In-process cache in front of Redis for the hottest users. Entries are only invalidated
+# by writes made through this process, so keep the TTL short.
+LOCAL_CACHE_SIZE = 1024
+LOCAL_CACHE_TTL = 30
+
+
+def user_to_hash(user_data: Dict) -> Dict:
+    """Flatten a user into Redis hash fields (None values are left out)"""
+    return {field: value for field, value in user_data.items() if value is not None}
+
+
+def user_from_hash(fields: Dict[bytes, bytes]) -> Dict:
+    """Rebuild a user from its Redis hash fields"""
+    age = fields.get(b'age')
+    created_at = fields.get(b'created_at')
+    return {
+        'id': int(fields[b'id']),
+        'name': fields[b'name'].decode(),
+        'email': fields[b'email'].decode(),
+        'age': int(age) if age is not None else None,
+        'created_at': created_at.decode() if created_at is not None else None,
+    }
+
+
+def user_key(user_id: int) -> str:
+    """Cache key for a single user"""
+    return f"user:{user_id}"
+
+
+def age_range_key(min_age: int, max_age: int) -> str:
+    """Cache key for an age range query"""
+    return f"users:age:{min_age}-{max_age}"
+
 
 class UserService:
-    def __init__(self, pg_connection_string: str, redis_host: str = 'localhost', redis_port: int = 6379):
-        # PostgreSQL connection
-        self.pg_conn = psycopg2.connect(pg_connection_string)
-        self.pg_cursor = self.pg_conn.cursor()
-        
-        # Redis connection
-        self.redis_client = redis.Redis(host=redis_host, port=redis_port, decode_responses=True)
+    def __init__(self, pg_connection_string: str, redis_host: str = 'localhost', redis_port: int = 6379,
+                 cache_format: str = 'msgpack', ttls: Optional[Dict[str, int]] = None,
+                 redis_socket: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE):
+        # Cache serialization: 'msgpack' (compact, binary) or 'json' (readable, via orjson)
+        if cache_format not in CACHE_FORMATS:
+            raise ValueError(f"Unknown cache format: {cache_format!r}")
+        self._encode, self._decode, self._array_writer = CACHE_FORMATS[cache_format]
+        
+        # Cache TTLs, optionally overriding the defaults per domain
+        self.ttls = {**DEFAULT_TTLS, **(ttls or {})}
+
+        # PostgreSQL connection pool (a connection is checked out per operation). psycopg2 closes
+        # any returned connection beyond minconn, so minconn == maxconn keeps every connection,
+        # and the statements prepared on it, open for reuse.
+        self.pool = ThreadedConnectionPool(pool_size, pool_size, pg_connection_string,
+                                           connection_factory=PreparingConnection)
+        # getconn() raises instead of waiting when every connection is in use, so callers
+        # queue on this semaphore first
+        self._pool_slots = threading.BoundedSemaphore(pool_size)
+        
+        # Redis connection (binary responses; both cache formats decode from bytes).
+        # A co-located Redis can be reached over a Unix socket (redis_socket or $REDIS_SOCK),
+        # which skips the TCP loopback stack; otherwise host/port are used.
+        redis_socket = redis_socket or os.environ.get("REDIS_SOCK")
+        self.redis_client = redis.Redis(host=redis_host, port=redis_port, unix_socket_path=redis_socket,
+                                        decode_responses=False)
+        self._release_lock = self.redis_client.register_script(RELEASE_LOCK_SCRIPT)
+        
+        # Local user cache (TTLCache isn't thread-safe, so access goes through a lock)
+        self._local = TTLCache(maxsize=LOCAL_CACHE_SIZE, ttl=LOCAL_CACHE_TTL)
+        self._local_lock = threading.Lock()
+        
+        # In-process lookups currently loading a user, keyed by user ID
+        self._inflight: Dict[int, Future] = {}
+        self._inflight_lock = threading.Lock()
         
         # Initialize database
         self._setup_database()
     
-    def _setup_database(self):
-        """Create users table if it doesn't exist"""
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS users (
-            id SERIAL PRIMARY KEY,
-            name VARCHAR(100) NOT NULL,
-            email VARCHAR(100) UNIQUE NOT NULL,
-            age INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
+    @contextmanager
+    def _cursor(self, name: Optional[str] = None):
+        """Check out a pooled connection and yield a cursor, committing on success
+
+        Rows are returned as dicts keyed by column name. Passing a name opens a
+        server-side cursor that streams rows instead of fetching them all at once.
+        Waits up to POOL_TIMEOUT seconds for a free connection, then raises PoolError.
         """
-        self.pg_cursor.execute(create_table_query)
-        self.pg_conn.commit()
-        
-        # Insert sample data if table is empty
-        self.pg_cursor.execute("SELECT COUNT(*) FROM users")
-        if self.pg_cursor.fetchone()[0] == 0:
-            sample_users = [
-                ('Alice Johnson', 'alice@example.com', 28),
-                ('Bob Smith', 'bob@example.com', 34),
-                ('Charlie Brown', 'charlie@example.com', 22),
-                ('Diana Wilson', 'diana@example.com', 31),
-                ('Eve Davis', 'eve@example.com', 26)
-            ]
+        if not self._pool_slots.acquire(timeout=POOL_TIMEOUT):
+            raise PoolError(f"no PostgreSQL connection became free within {POOL_TIMEOUT} seconds")
+        try:
+            conn = self.pool.getconn()
+            try:
+                with conn.cursor(name=name, cursor_factory=RealDictCursor) as cur:
+                    yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                self.pool.putconn(conn)
+        finally:
+            self._pool_slots.release()
+
+    def _prepare(self, cur):
+        """Prepare the hot-path statements on the cursor's connection if not done yet"""
+        conn = cur.connection
+        if not conn.prepared:
+            # Send all PREPAREs in a single roundtrip
+            cur.execute(PREPARE_SQL)
+            conn.prepared = True
+
+    def _ttl(self, domain: str) -> int:
+        """Return the TTL for a cache domain with random jitter applied (never below 1 second)"""
+        # SETEX rejects 0 and EXPIRE 0 deletes the key, which small base TTLs could round down to
+        return max(1, int(self.ttls[domain] * random.uniform(1 - TTL_JITTER, 1 + TTL_JITTER)))
+
+    def _max_ttl(self, domain: str) -> int:
+        """Return the longest TTL _ttl() can produce for a cache domain"""
+        return int(self.ttls[domain] * (1 + TTL_JITTER)) + 1
+
+    def _setup_database(self):
+        """Create users table and indexes if they don't exist"""
+        with self._cursor() as cur:
+            # Create the table and check for existing data in one roundtrip;
+            # the cursor holds the result of the last statement
+            cur.execute(CREATE_TABLE_SQL + SEED_CHECK_SQL)
             
-            insert_query = "INSERT INTO users (name, email, age) VALUES (%s, %s, %s)"
-            self.pg_cursor.executemany(insert_query, sample_users)
-            self.pg_conn.commit()
-            print("Sample data inserted into PostgreSQL")
+            # Insert sample data if table is empty (LIMIT 1 stops at the first row, unlike COUNT(*))
+            if cur.fetchone() is None:
+                sample_users = [
+                    ('Alice Johnson', 'alice@example.com', 28),
+                    ('Bob Smith', 'bob@example.com', 34),
+                    ('Charlie Brown', 'charlie@example.com', 22),
+                    ('Diana Wilson', 'diana@example.com', 31),
+                    ('Eve Davis', 'eve@example.com', 26)
+                ]
+                
+                # execute_values sends all rows in a single INSERT (executemany is one roundtrip per row)
+                execute_values(cur, SEED_USERS_SQL, sample_users, page_size=500)
+                logger.info("Sample data inserted into PostgreSQL")
 
     def get_user_by_id(self, user_id: int) -> Optional[Dict]:
-        """Get user by ID with Redis caching"""
-        cache_key = f"user:{user_id}"
+        """Get user by ID with local and Redis caching"""
+        cache_key = user_key(user_id)
         
-        # Try to get from Redis cache first
-        print(f"🔍 Checking Redis cache for user {user_id}")
-        cached_user = self.redis_client.get(cache_key)
+        # Hot users are served from the in-process cache without a Redis roundtrip
+        with self._local_lock:
+            user_data = self._local.get(user_id)
+        if user_data is not None:
+            logger.debug("✅ Local cache HIT for user %s", user_id)
+            return dict(user_data)
+        
+        # Then try Redis
+        logger.debug("🔍 Checking Redis cache for user %s", user_id)
+        cached_user = self.redis_client.hgetall(cache_key)
         
         if cached_user:
-            print("✅ Cache HIT - returning from Redis")
-            return json.loads(cached_user)
+            logger.debug("✅ Cache HIT - returning from Redis")
+            user_data = self._decode_user(cached_user)
+            self._cache_locally(user_id, user_data)
+            return user_data
         
-        # Cache miss - query PostgreSQL
-        print("❌ Cache MISS - querying PostgreSQL")
+        # Cache miss - only one thread per process loads the user, the rest wait for its result
+        logger.debug("❌ Cache MISS")
+        with self._inflight_lock:
+            future = self._inflight.get(user_id)
+            is_leader = future is None
+            if is_leader:
+                future = self._inflight[user_id] = Future()
+        
+        if not is_leader:
+            logger.debug("⏳ Waiting for in-flight lookup of user %s", user_id)
+            # The leader returns the same object, so each follower gets its own copy
+            user_data = future.result()
+            return dict(user_data) if user_data is not None else None
+        
+        try:
+            user_data = self._load_user(user_id, cache_key)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            self._cache_locally(user_id, user_data)
+            future.set_result(user_data)
+            return user_data
+        finally:
+            with self._inflight_lock:
+                del self._inflight[user_id]
+
+    def _cache_locally(self, user_id: int, user_data: Optional[Dict]):
+        """Store a copy of a found user in the in-process cache
+
+        Cached entries are never handed out directly, so callers modifying a
+        returned user can't change what other readers see.
+        """
+        if user_data is not None:
+            with self._local_lock:
+                self._local[user_id] = dict(user_data)
+
+    def _evict_locally(self, user_id: int):
+        """Drop a user from the in-process cache"""
+        with self._local_lock:
+            self._local.pop(user_id, None)
+
+    def _load_user(self, user_id: int, cache_key: str) -> Optional[Dict]:
+        """Load a user on cache miss, holding a Redis lock so only one process queries PostgreSQL"""
+        lock_key = f"lock:{cache_key}"
+        token = uuid.uuid4().hex
+        if self.redis_client.set(lock_key, token, nx=True, px=LOCK_TIMEOUT_MS):
+            try:
+                return self._query_user(user_id)
+            finally:
+                self._release_lock(keys=[lock_key], args=[token])
+        
+        # Another process is loading this user - wait for it to populate the cache
+        logger.debug("⏳ Another worker is loading user %s, waiting for cache", user_id)
+        deadline = time.monotonic() + LOCK_TIMEOUT_MS / 1000
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            cached_user = self.redis_client.hgetall(cache_key)
+            if cached_user:
+                logger.debug("✅ Cache HIT - populated by another worker")
+                return self._decode_user(cached_user)
+            if not self.redis_client.exists(lock_key):
+                break
+        
+        return self._query_user(user_id)
+
+    def _query_user(self, user_id: int) -> Optional[Dict]:
+        """Query a user from PostgreSQL and store it in Redis"""
+        logger.debug("🐘 Querying PostgreSQL")
         start_time = time.time()
         
-        query = "SELECT id, name, email, age, created_at FROM users WHERE id = %s"
-        self.pg_cursor.execute(query, (user_id,))
-        result = self.pg_cursor.fetchone()
+        with self._cursor() as cur:
+            self._prepare(cur)
+            cur.execute("EXECUTE get_user(%s)", (user_id,))
+            user_data = cur.fetchone()
         
         db_query_time = time.time() - start_time
-        print(f"📊 PostgreSQL query took: {db_query_time:.4f} seconds")
-        
-        if result:
-            user_data = {
-                'id': result[0],
-                'name': result[1],
-                'email': result[2],
-                'age': result[3],
-                'created_at': result[4].isoformat() if result[4] else None
-            }
+        logger.debug("📊 PostgreSQL query took: %.4f seconds", db_query_time)
+        
+        # Cache the user, or remember for a short while that it doesn't exist
+        with self.redis_client.pipeline() as pipe:
+            self._write_user(pipe, user_id, user_data)
+            pipe.execute()
+        logger.debug("💾 Stored in Redis cache" if user_data is not None else "💾 Cached not-found result")
+        
+        return user_data
+
+    def _write_user(self, pipe, user_id: int, user_data: Optional[Dict]):
+        """Queue replacing a cached user hash, or a not-found marker when user_data is None"""
+        cache_key = user_key(user_id)
+        pipe.delete(cache_key)
+        if user_data is None:
+            pipe.hset(cache_key, NOT_FOUND_FIELD, 1)
+            pipe.expire(cache_key, self._ttl('not_found'))
+        else:
+            pipe.hset(cache_key, mapping=user_to_hash(user_data))
+            pipe.expire(cache_key, self._ttl('user'))
+
+    def _decode_user(self, cached_user: Dict[bytes, bytes]) -> Optional[Dict]:
+        """Decode a cached user hash, mapping the not-found marker back to None"""
+        if NOT_FOUND_FIELD in cached_user:
+            return None
+        return user_from_hash(cached_user)
+
+    def get_users_by_ids(self, user_ids: List[int]) -> List[Optional[Dict]]:
+        """Get several users by ID with one Redis roundtrip and one PostgreSQL query for the misses
+
+        Results are returned in the order of user_ids, with None for users that don't exist.
+        """
+        users: Dict[int, Optional[Dict]] = {}
+        with self._local_lock:
+            for user_id in user_ids:
+                user_data = self._local.get(user_id)
+                if user_data is not None:
+                    users[user_id] = dict(user_data)
+        
+        remote_ids = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in users]
+        if not remote_ids:
+            logger.debug("✅ Local cache HIT for all %s users", len(user_ids))
+            return [users[user_id] for user_id in user_ids]
+        
+        logger.debug("🔍 Checking Redis cache for %s users", len(remote_ids))
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            for user_id in remote_ids:
+                pipe.hgetall(user_key(user_id))
+            cached_users = pipe.execute()
+        
+        misses = []
+        for user_id, cached_user in zip(remote_ids, cached_users):
+            if cached_user:
+                users[user_id] = self._decode_user(cached_user)
+                self._cache_locally(user_id, users[user_id])
+            else:
+                misses.append(user_id)
+        
+        if misses:
+            logger.debug("❌ Cache MISS for %s users - querying PostgreSQL", len(misses))
+            start_time = time.time()
             
-            # Store in Redis cache with 5-minute expiration
-            self.redis_client.setex(cache_key, 300, json.dumps(user_data))
-            print("💾 Stored in Redis cache (expires in 5 minutes)")
+            with self._cursor() as cur:
+                self._prepare(cur)
+                cur.execute("EXECUTE get_users_by_ids(%s)", (misses,))
+                found = {row['id']: row for row in cur.fetchall()}
             
-            return user_data
-        
-        return None
+            db_query_time = time.time() - start_time
+            logger.debug("📊 PostgreSQL query took: %.4f seconds", db_query_time)
+            
+            # Cache found users and not-found markers in one roundtrip
+            with self.redis_client.pipeline() as pipe:
+                for user_id in misses:
+                    user_data = found.get(user_id)
+                    self._write_user(pipe, user_id, user_data)
+                    self._cache_locally(user_id, user_data)
+                    users[user_id] = user_data
+                pipe.execute()
+            logger.debug("💾 Stored %s users in Redis cache", len(misses))
+        
+        return [users[user_id] for user_id in user_ids]
 
     def get_users_by_age_range(self, min_age: int, max_age: int) -> List[Dict]:
         """Get users by age range with Redis caching"""
-        cache_key = f"users:age:{min_age}-{max_age}"
+        cache_key = age_range_key(min_age, max_age)
         
-        print(f"🔍 Checking Redis cache for age range {min_age}-{max_age}")
+        logger.debug("🔍 Checking Redis cache for age range %s-%s", min_age, max_age)
         cached_users = self.redis_client.get(cache_key)
         
         if cached_users:
-            print("✅ Cache HIT - returning from Redis")
-            return json.loads(cached_users)
+            logger.debug("✅ Cache HIT - returning from Redis")
+            return self._decode(cached_users)
         
-        print("❌ Cache MISS - querying PostgreSQL")
+        logger.debug("❌ Cache MISS - querying PostgreSQL")
         start_time = time.time()
         
-        query = "SELECT id, name, email, age FROM users WHERE age BETWEEN %s AND %s ORDER BY age"
-        self.pg_cursor.execute(query, (min_age, max_age))
-        results = self.pg_cursor.fetchall()
+        with self._cursor() as cur:
+            self._prepare(cur)
+            cur.execute("EXECUTE get_users_by_age(%s, %s)", (min_age, max_age))
+            users_data = cur.fetchall()
         
         db_query_time = time.time() - start_time
-        print(f"📊 PostgreSQL query took: {db_query_time:.4f} seconds")
-        
-        users_data = [
-            {'id': row[0], 'name': row[1], 'email': row[2], 'age': row[3]}
-            for row in results
-        ]
+        logger.debug("📊 PostgreSQL query took: %.4f seconds", db_query_time)
         
-        # Cache for 2 minutes
-        self.redis_client.setex(cache_key, 120, json.dumps(users_data))
-        print("💾 Stored in Redis cache (expires in 2 minutes)")
+        self._cache_age_range(cache_key, self._encode(users_data))
         
         return users_data
 
+    def iter_users_by_age_range(self, min_age: int, max_age: int) -> Iterator[Dict]:
+        """Stream users by age range, caching the result once it has been read in full
+
+        On a cache miss rows come from a server-side cursor and are encoded into the
+        cache payload as they are yielded, so a large range is never held as a list.
+        A pooled connection stays checked out until iteration ends (other callers wait
+        for it once the pool is full), so consume or close the iterator promptly;
+        stopping early skips caching.
+        """
+        cache_key = age_range_key(min_age, max_age)
+        
+        logger.debug("🔍 Checking Redis cache for age range %s-%s", min_age, max_age)
+        cached_users = self.redis_client.get(cache_key)
+        
+        if cached_users:
+            logger.debug("✅ Cache HIT - returning from Redis")
+            yield from self._decode(cached_users)
+            return
+        
+        logger.debug("❌ Cache MISS - streaming from PostgreSQL")
+        writer = self._array_writer()
+        with self._cursor(name="users_by_age_range") as cur:
+            cur.itersize = AGE_RANGE_ITERSIZE
+            cur.execute(AGE_RANGE_SQL, (min_age, max_age))
+            for row in cur:
+                writer.append(row)
+                yield row
+        
+        self._cache_age_range(cache_key, writer.finish())
+
+    def _cache_age_range(self, cache_key: str, payload):
+        """Cache an encoded age range result and record its key in the index, in one roundtrip"""
+        ttl = self._ttl('age_range')
+        with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.setex(cache_key, ttl, payload)
+            pipe.sadd(AGE_RANGE_INDEX_KEY, cache_key)
+            # The index outlives every member it records, so it never drops a live key
+            pipe.expire(AGE_RANGE_INDEX_KEY, self._max_ttl('age_range'))
+            pipe.execute()
+        logger.debug("💾 Stored in Redis cache (expires in %s seconds)", ttl)
+
     def create_user(self, name: str, email: str, age: int) -> Dict:
-        """Create a new user and invalidate related caches"""
-        query = "INSERT INTO users (name, email, age) VALUES (%s, %s, %s) RETURNING id, created_at"
-        self.pg_cursor.execute(query, (name, email, age))
-        result = self.pg_cursor.fetchone()
-        self.pg_conn.commit()
+        """Create a new user, cache it and invalidate related caches"""
+        with self._cursor() as cur:
+            cur.execute(CREATE_USER_SQL, (name, email, age))
+            result = cur.fetchone()
         
         user_data = {
-            'id': result[0],
+            'id': result['id'],
             'name': name,
             'email': email,
             'age': age,
-            'created_at': result[1].isoformat()
+            'created_at': result['created_at']
         }
         
-        # Invalidate age range caches (simple approach - delete all age range keys)
-        pattern = "users:age:*"
-        for key in self.redis_client.scan_iter(match=pattern):
-            self.redis_client.delete(key)
-        print("🗑️ Invalidated age range caches")
+        with self.redis_client.pipeline() as pipe:
+            # Write-through: cache the new user (also replaces any stale entry for this ID)
+            self._write_user(pipe, user_data['id'], user_data)
+            
+            # Invalidate age range caches (a new user may fall into any range)
+            self._invalidate_age_range_caches(pipe)
+            pipe.execute()
+        self._evict_locally(user_data['id'])
+        logger.debug("💾 Cached new user %s", user_data['id'])
+        logger.debug("🗑️ Invalidated age range caches")
         
         return user_data
 
     def update_user(self, user_id: int, **kwargs) -> Optional[Dict]:
-        """Update user and invalidate cache"""
-        # Build dynamic update query
-        set_clause = ", ".join([f"{key} = %s" for key in kwargs.keys()])
-        values = list(kwargs.values()) + [user_id]
-        
-        query = f"UPDATE users SET {set_clause} WHERE id = %s RETURNING id, name, email, age, created_at"
-        self.pg_cursor.execute(query, values)
-        result = self.pg_cursor.fetchone()
-        self.pg_conn.commit()
-        
-        if result:
-            # Invalidate specific user cache
-            cache_key = f"user:{user_id}"
-            self.redis_client.delete(cache_key)
-            print(f"🗑️ Invalidated cache for user {user_id}")
-            
-            # Also invalidate age range caches if age was updated
+        """Update user, refresh its cache entry and invalidate related caches"""
+        # Column names end up in the SQL, so only known columns are accepted
+        if not kwargs:
+            raise ValueError("No columns to update")
+        invalid = kwargs.keys() - UPDATABLE_COLUMNS
+        if invalid:
+            raise ValueError(f"Cannot update columns: {', '.join(sorted(invalid))}")
+        
+        # Update statements are cached per set of columns
+        columns = tuple(sorted(kwargs))
+        values = [kwargs[column] for column in columns] + [user_id]
+        
+        with self._cursor() as cur:
+            cur.execute(update_sql(columns, cur), values)
+            user_data = cur.fetchone()
+        
+        if user_data:
+            with self.redis_client.pipeline() as pipe:
+                # Write-through: replace the cached user with the updated row
+                self._write_user(pipe, user_id, user_data)
+                
+                # Also invalidate age range caches if age was updated
+                if 'age' in kwargs:
+                    self._invalidate_age_range_caches(pipe)
+                pipe.execute()
+            self._evict_locally(user_id)
+            logger.debug("💾 Refreshed cache for user %s", user_id)
             if 'age' in kwargs:
-                pattern = "users:age:*"
-                for key in self.redis_client.scan_iter(match=pattern):
-                    self.redis_client.delete(key)
-                print("🗑️ Invalidated age range caches")
+                logger.debug("🗑️ Invalidated age range caches")
             
-            return {
-                'id': result[0],
-                'name': result[1],
-                'email': result[2],
-                'age': result[3],
-                'created_at': result[4].isoformat()
-            }
+            return user_data
         
         return None
 
+    def _invalidate_age_range_caches(self, pipe):
+        """Queue deletion of all cached age range results tracked in the index set"""
+        keys = self.redis_client.smembers(AGE_RANGE_INDEX_KEY)
+        if keys:
+            # Only remove the members read here; keys added since then stay indexed
+            pipe.unlink(*keys)
+            pipe.srem(AGE_RANGE_INDEX_KEY, *keys)
+
     def get_cache_stats(self) -> Dict:
         """Get Redis cache statistics"""
         info = self.redis_client.info()
@@ -193,12 +631,11 @@ class UserService:
     def clear_all_cache(self):
         """Clear all cached data"""
         self.redis_client.flushdb()
-        print("🗑️ All cache cleared")
+        logger.debug("🗑️ All cache cleared")
 
     def close(self):
         """Close connections"""
-        self.pg_cursor.close()
-        self.pg_conn.close()
+        self.pool.closeall()
         self.redis_client.close()
 
 
@@ -234,15 +671,15 @@ def demo():
         young_users_cached = service.get_users_by_age_range(20, 30)  # Cache hit
         print(f"Found {len(young_users_cached)} users aged 20-30")
         
-        # Demo 3: Cache invalidation
-        print("\n3️⃣ DEMO: Cache Invalidation")
+        # Demo 3: Write-through caching
+        print("\n3️⃣ DEMO: Write-Through Caching")
         print("-" * 30)
         print("Updating user 1...")
         updated_user = service.update_user(1, age=29)
         print(f"Updated: {updated_user['name']} is now {updated_user['age']} years old")
         
-        print("\nQuerying user 1 again (cache was invalidated):")
-        user1_updated = service.get_user_by_id(1)  # Cache miss due to invalidation
+        print("\nQuerying user 1 again (cache was refreshed by the update):")
+        user1_updated = service.get_user_by_id(1)  # Cache hit with updated data
         print(f"User: {user1_updated['name']}, Age: {user1_updated['age']}")
         
         # Demo 4: Cache statistics
@@ -263,4 +700,7 @@ def demo():
 
 
 if __name__ == "__main__":
+    # Show the service's cache/database trace alongside the demo output
+    logging.basicConfig(format="%(message)s")
+    logger.setLevel(logging.DEBUG)
     demo()
\ No newline at end of file
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+
+import orjson
+import pytest
+
+from main import (
+    _DEC,
+    NOT_FOUND_FIELD,
+    JsonArrayWriter,
+    MsgpackArrayWriter,
+    UserService,
+    user_from_hash,
+    user_to_hash,
+)
+
+USERS = [
+    {'id': 1, 'name': 'Alice Johnson', 'email': 'alice@example.com', 'age': 28},
+    {'id': 2, 'name': 'Bob Smith', 'email': 'bob@example.com', 'age': None},
+]
+
+WRITERS = [
+    (MsgpackArrayWriter, _DEC.decode),
+    (JsonArrayWriter, orjson.loads),
+]
+
+
+def write_all(writer_cls, items) -> bytes:
+    writer = writer_cls()
+    for item in items:
+        writer.append(item)
+    # Redis hands the payload back as bytes
+    return bytes(writer.finish())
+
+
+@pytest.mark.parametrize("writer_cls, decode", WRITERS)
+def test_array_writer_round_trip(writer_cls, decode):
+    assert decode(write_all(writer_cls, USERS)) == USERS
+
+
+@pytest.mark.parametrize("writer_cls, decode", WRITERS)
+def test_array_writer_round_trip_dict_subclass_rows(writer_cls, decode):
+    # RealDictCursor rows are OrderedDict subclasses
+    rows = [OrderedDict(user) for user in USERS]
+    assert decode(write_all(writer_cls, rows)) == USERS
+
+
+@pytest.mark.parametrize("writer_cls, decode", WRITERS)
+def test_array_writer_empty(writer_cls, decode):
+    assert decode(write_all(writer_cls, [])) == []
+
+
+def test_msgpack_array_writer_length_beyond_array16():
+    items = list(range(70000))
+    assert _DEC.decode(write_all(MsgpackArrayWriter, items)) == items
+
+
+def as_redis_hash(fields) -> dict:
+    # HGETALL with decode_responses=False returns bytes field names and values
+    return {key.encode(): str(value).encode() for key, value in fields.items()}
+
+
+def make_service() -> UserService:
+    # Skips __init__, which connects to PostgreSQL and Redis; the methods under test don't use them
+    return UserService.__new__(UserService)
+
+
+def test_user_hash_round_trip():
+    user = {'id': 7, 'name': 'Alice Johnson', 'email': 'alice@example.com', 'age': 28,
+            'created_at': '2024-01-02T03:04:05.000006'}
+    assert user_from_hash(as_redis_hash(user_to_hash(user))) == user
+
+
+def test_user_hash_round_trip_with_null_fields():
+    user = {'id': 7, 'name': 'Alice Johnson', 'email': 'alice@example.com', 'age': None, 'created_at': None}
+    fields = user_to_hash(user)
+    assert 'age' not in fields and 'created_at' not in fields
+    assert user_from_hash(as_redis_hash(fields)) == user
+
+
+def test_decode_user_not_found_marker():
+    assert make_service()._decode_user({NOT_FOUND_FIELD: b'1'}) is None
+
+
+def test_decode_user_found():
+    user = {'id': 3, 'name': 'Charlie Brown', 'email': 'charlie@example.com', 'age': 22, 'created_at': None}
+    assert make_service()._decode_user(as_redis_hash(user_to_hash(user))) == user
+
+
+def test_update_user_requires_columns():
+    with pytest.raises(ValueError, match="No columns"):
+        make_service().update_user(1)
+
+
+def test_update_user_rejects_unknown_columns():
+    with pytest.raises(ValueError, match="id, password"):
+        make_service().update_user(1, age=30, password='x', id=2)